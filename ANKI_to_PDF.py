@@ -1,50 +1,261 @@
 # -*- coding: utf-8 -*-
 import requests # Pro komunikaci s AnkiConnect
+from requests.adapters import HTTPAdapter
 import json
-import base64 # Pro dekódování mediálních souborů
+import binascii # Pro dekódování mediálních souborů (base64)
 import argparse
 import os
 import io
 import re
-from reportlab.platypus import (SimpleDocTemplate, Paragraph, Spacer, Image,
-                                PageBreak, Flowable)
+import html
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from reportlab import rl_config
+from reportlab.platypus import (BaseDocTemplate, PageTemplate, Frame, Paragraph,
+                                Spacer, PageBreak, Flowable)
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_LEFT
 from reportlab.lib.units import cm
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import A4
+# Volitelný záložní parser pro složitější HTML (skripty, styly, komentáře)
+try:
+    from lxml import html as lxml_html
+except ImportError:  # lxml není nainstalováno
+    lxml_html = None
 # Optional komprese obrázků pomocí Pillow
 try:
+    import PIL
     from PIL import Image as PILImage
 except ImportError:  # Pillow není nainstalována
     PILImage = None
+# Volitelné rychlé překódování JPEG přes libjpeg-turbo (PyTurboJPEG)
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_444, TJSAMP_422, TJSAMP_420, TJFLAG_PROGRESSIVE
+    _TURBOJPEG = TurboJPEG()
+    _TJ_SUBSAMPLING = {0: TJSAMP_444, 1: TJSAMP_422, 2: TJSAMP_420}
+except (ImportError, RuntimeError, OSError):  # balíček nebo knihovna libturbojpeg chybí
+    _TURBOJPEG = None
+# Volitelný rychlejší JSON (orjson vrací rovnou bytes pro tělo požadavku)
+try:
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads  # orjson.JSONDecodeError je podtřídou json.JSONDecodeError
+except ImportError:  # orjson není nainstalován
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    _json_loads = json.loads
+# Volitelný SIMD JSON parser pro velké odpovědi 'cardsInfo' (líný přístup k polím)
+try:
+    import simdjson
+except ImportError:  # pysimdjson není nainstalován
+    simdjson = None
+# Volitelné SIMD dekódování base64 (pybase64), jinak binascii ze standardní knihovny
+try:
+    import pybase64
+    _b64decode = pybase64.b64decode  # výchozí validate=False, přijímá i memoryview
+except ImportError:  # pybase64 není nainstalován
+    _b64decode = binascii.a2b_base64
+# Volitelné rychlejší hashování obsahu obrázků (BLAKE3), jinak BLAKE2b z hashlib
+try:
+    from blake3 import blake3
+    def _media_digest(data):
+        return blake3(data).digest(length=16)
+except ImportError:  # blake3 není nainstalován
+    def _media_digest(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
 from reportlab.lib.colors import navy, black, red
 # Importy pro registraci TTF fontu
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 
+# Vypnutí kontroly typů atributů v ReportLab - dokument sestavujeme sami a správně
+rl_config.shapeChecking = 0
+# Obrázky vkládat binárně (bez kódování ASCII-85) a komprimovat obsah stránek
+rl_config.useA85 = 0
+rl_config.pageCompression = 1
+
 # --- Globální log chyb ---
 error_log = []
-# Cache pro již načtené mediální soubory
-IMAGE_CACHE = {}
+# Cache pro již načtené mediální soubory podle obsahu (LRU):
+# otisk dat -> {'data': bytes, 'w': int, 'h': int, 'reader': ImageReader, 'size': int}
+IMAGE_CACHE = OrderedDict()
+# Název souboru -> otisk dat v IMAGE_CACHE (různé názvy se stejným obsahem sdílí položku)
+MEDIA_INDEX = {}
+# Soubory, které AnkiConnect nevrátil nebo je nelze dekódovat - znovu se nenačítají
+MISSING_MEDIA = set()
+# Maximální velikost položek IMAGE_CACHE (bajty): data obrázku a po jejich
+# dekódování při sestavení PDF i pixely, které si ImageReader ponechá.
+# Limit omezuje jen to, co drží sama cache - obrázky aktuálního dokumentu drží
+# až do konce jeho sestavení příběh a create_pdf_connect(), takže se kvůli
+# vyřazení z cache znovu nenačítají.
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+_image_cache_bytes = 0
+_image_cache_lock = threading.Lock()
+# Cache vypočtených rozměrů pro vykreslení: (název, max. šířka, max. výška) -> (šířka, výška)
+DRAW_SIZE_CACHE = {}
+# Složka collection.media zjištěná přes AnkiConnect (None = není lokálně dostupná)
+_MEDIA_DIR_UNKNOWN = object()
+_media_dir = _MEDIA_DIR_UNKNOWN
 
 # Výchozí kompresní kvalita pro ukládání obrázků
-DEFAULT_IMAGE_QUALITY = 85
+DEFAULT_IMAGE_QUALITY = 75
+# Progresivní JPEG a podvzorkování barev 4:2:0 (0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0)
+DEFAULT_JPEG_PROGRESSIVE = True
+DEFAULT_JPEG_SUBSAMPLING = 2
+# Rozlišení (DPI), na které se zmenšují obrázky širší než dostupná šířka stránky
+IMAGE_DPI = 200
+# Počet akcí retrieveMediaFile v jednom požadavku 'multi'
+MEDIA_BATCH_SIZE = 50
+# Počet vláken pro paralelní načítání a kompresi médií
+MEDIA_WORKERS = 16
+
+# Signatura začátku souboru JPEG
+_JPEG_MAGIC = b'\xff\xd8\xff'
+# JPEG menší než tento limit (v bajtech) se znovu nekóduje
+SMALL_JPEG_BYTES = 150_000
+# JPEG, který se vejde na šířku stránky a má nejvýše tolik bitů na pixel, se ponechá beze změny
+KEEP_JPEG_MAX_BPP = 2.0
 
-def compress_image(data, quality=DEFAULT_IMAGE_QUALITY):
-    """Zmenší a zkomprimuje obrázek do JPEG, pokud je k dispozici Pillow."""
+def image_backend_name():
+    """Vrátí popis knihovny, která se použije pro kompresi obrázků (nebo None)."""
+    if _TURBOJPEG is not None:
+        return "libjpeg-turbo (PyTurboJPEG)"
+    if PILImage is None:
+        return None
+    # Pillow-SIMD označuje své verze příponou .postN
+    if '.post' in PIL.__version__:
+        return f"Pillow-SIMD {PIL.__version__}"
+    return f"Pillow {PIL.__version__}"
+
+def compress_image(data, quality=DEFAULT_IMAGE_QUALITY, target_px_width=None,
+                   progressive=DEFAULT_JPEG_PROGRESSIVE, subsampling=DEFAULT_JPEG_SUBSAMPLING):
+    """Zmenší a zkomprimuje obrázek do JPEG, pokud je k dispozici Pillow.
+
+    Je-li zadána ``target_px_width``, obrázky širší než tato hodnota se před
+    uložením zmenší, aby PDF neobsahovalo pixely, které stránka nezobrazí.
+    JPEG, který zmenšovat netřeba, se překóduje přes libjpeg-turbo, je-li k dispozici.
+    Malé nebo již dostatečně zkomprimované JPEG se vrací beze změny - opakované
+    kódování by jen stálo čas a snížilo kvalitu.
+    """
+    if data[:3] == _JPEG_MAGIC:
+        if len(data) < SMALL_JPEG_BYTES:
+            return data
+        if PILImage is not None:
+            try:
+                with PILImage.open(io.BytesIO(data)) as im:  # čte jen hlavičku
+                    width, height = im.size
+                if ((not target_px_width or width <= target_px_width)
+                        and len(data) * 8 <= width * height * KEEP_JPEG_MAX_BPP):
+                    return data
+            except Exception:
+                pass  # Poškozenou hlavičku řeší komprese níže
+    if _TURBOJPEG is not None and data[:3] == _JPEG_MAGIC:
+        try:
+            if not target_px_width or _TURBOJPEG.decode_header(data)[0] <= target_px_width:
+                return _TURBOJPEG.encode(_TURBOJPEG.decode(data), quality=quality,
+                                         jpeg_subsample=_TJ_SUBSAMPLING[subsampling],
+                                         flags=TJFLAG_PROGRESSIVE if progressive else 0)
+        except Exception:
+            pass  # Pokračujeme přes Pillow
     if PILImage is None:
         return data
     try:
         with PILImage.open(io.BytesIO(data)) as im:
             rgb_im = im.convert("RGB")
+            if target_px_width and rgb_im.width > target_px_width:
+                rgb_im.thumbnail((target_px_width, target_px_width * 10), PILImage.LANCZOS)
             out = io.BytesIO()
-            rgb_im.save(out, format="JPEG", quality=quality, optimize=True)
+            # Bez optimize=True - druhý průchod Huffmanových tabulek je pomalý a
+            # podvzorkování s progresivním kódováním ušetří víc
+            rgb_im.save(out, format="JPEG", quality=quality, optimize=False,
+                        progressive=progressive, subsampling=subsampling)
             return out.getvalue()
     except Exception:
         # Pokud komprese selže, vrátíme původní data
         return data
 
+class _CachedImageReader(ImageReader):
+    """ImageReader položky IMAGE_CACHE, který po dekódování pixelů započítá jejich velikost do cache."""
+    def __init__(self, fileName, digest):
+        ImageReader.__init__(self, fileName)
+        self.digest = digest
+
+    def getRGBData(self):
+        # ReportLab pixely dekóduje až při vkládání obrázku do PDF a pak si je ponechá
+        decoded = self._data is not None
+        data = ImageReader.getRGBData(self)
+        if not decoded and data:
+            _count_decoded_media(self, len(data))
+        return data
+
+def _count_decoded_media(reader, nbytes):
+    """Přičte dekódované pixely k velikosti položky IMAGE_CACHE, pokud v cache stále je."""
+    global _image_cache_bytes
+    with _image_cache_lock:
+        entry = IMAGE_CACHE.get(reader.digest)
+        if entry is not None and entry['reader'] is reader:
+            entry['size'] += nbytes
+            _image_cache_bytes += nbytes
+            IMAGE_CACHE.move_to_end(reader.digest)
+            _evict_media_locked()
+
+def _evict_media_locked():
+    """Odstraní nejdéle nepoužité položky IMAGE_CACHE nad limit (volá se se zámkem)."""
+    global _image_cache_bytes
+    while _image_cache_bytes > IMAGE_CACHE_MAX_BYTES and len(IMAGE_CACHE) > 1:
+        _, evicted = IMAGE_CACHE.popitem(last=False)
+        _image_cache_bytes -= evicted['size']
+
+def make_media_entry(data, digest=None):
+    """Vytvoří položku IMAGE_CACHE s daty obrázku, jeho rozměry a sdíleným ImageReaderem.
+
+    Stejný ImageReader používají všechny výskyty obrázku, takže ReportLab
+    obrázek do PDF vloží jen jednou. Velikost položky zpočátku zahrnuje jen
+    data, dekódované pixely se přičtou až ve chvíli, kdy je ReportLab vytvoří.
+    """
+    try:
+        reader = _CachedImageReader(io.BytesIO(data), digest)
+        width, height = reader.getSize()
+    except Exception:
+        # Rozměry zjistí (a případnou chybu zaloguje) až ResizableImage
+        reader = width = height = None
+    return {'data': data, 'w': width, 'h': height, 'reader': reader, 'size': len(data)}
+
+def cache_media(filename, data):
+    """Uloží data obrázku do IMAGE_CACHE pod otiskem obsahu a vrátí jeho položku.
+
+    Pokud je cache přeplněná, odstraní se nejdéle nepoužité položky.
+    """
+    global _image_cache_bytes
+    digest = _media_digest(data)
+    with _image_cache_lock:
+        entry = IMAGE_CACHE.get(digest)
+    if entry is None:
+        entry = make_media_entry(data, digest)
+    with _image_cache_lock:
+        MEDIA_INDEX[filename] = digest
+        if digest in IMAGE_CACHE:
+            # Stejný obsah pod jiným názvem (nebo souběžně z jiného vlákna)
+            entry = IMAGE_CACHE[digest]
+            IMAGE_CACHE.move_to_end(digest)
+            return entry
+        IMAGE_CACHE[digest] = entry
+        _image_cache_bytes += entry['size']
+        _evict_media_locked()
+    return entry
+
+def cached_media(filename):
+    """Vrátí položku IMAGE_CACHE pro daný název souboru, nebo None, pokud v cache není."""
+    with _image_cache_lock:
+        digest = MEDIA_INDEX.get(filename)
+        entry = IMAGE_CACHE.get(digest) if digest is not None else None
+        if entry is not None:
+            IMAGE_CACHE.move_to_end(digest)
+        return entry
+
 def log_error(note_id, message):
     """Přidá položku do chybového logu a vypíše ji na konzoli."""
     entry = f"note_id={note_id}: {message}"
@@ -54,17 +265,72 @@ def log_error(note_id, message):
 # --- Konfigurace ---
 ANKICONNECT_URL = "http://127.0.0.1:8765" # Standardní adresa AnkiConnect
 ANKICONNECT_VERSION = 6
+ANKICONNECT_TIMEOUT = 30 # Časový limit jednoho požadavku (s)
+# Sdílená HTTP session - udržuje spojení (keep-alive) mezi požadavky i vlákny
+_SESSION = requests.Session()
+_SESSION.headers['Connection'] = 'keep-alive'
+# Jedno spojení pro každé vlákno načítající média a jedno pro hlavní vlákno
+_SESSION.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=MEDIA_WORKERS + 1))
+
+# Okraje stránky PDF
+PAGE_MARGIN = 1.5*cm
+# TTF font s podporou UTF-8 - předpokládáme, že DejaVuSans.ttf je ve stejné složce
+FONT_PATH = 'DejaVuSans.ttf'
+FONT_NAME = 'DejaVu' # Jméno, pod kterým budeme font používat
 
 # Seznamy názvů polí
 QUESTION_FIELD_NAMES = ["front", "question", "otázka", "q", "term", "text"]
 ANSWER_FIELD_NAMES = ["back", "answer", "odpověď", "a", "definition", "back extra"]
+# Předpočítané n-tice názvů v malých písmenech (v pořadí priority)
+_Q_FIELDS = tuple(name.lower() for name in QUESTION_FIELD_NAMES)
+_A_FIELDS = tuple(name.lower() for name in ANSWER_FIELD_NAMES)
 
 # --- Pomocné Třídy a Funkce ---
 
+# Escapování textu pro XML odstavců ReportLab a převod konců řádků v jednom průchodu
+_PARAGRAPH_ESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '\n': '<br/>'})
+
+def register_card_font():
+    """Zaregistruje TTF font s podporou UTF-8 a vrátí jeho název.
+
+    Font se registruje jen jednou; pokud registrace selže, vrátí se 'Helvetica'.
+    """
+    if FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return FONT_NAME
+    try:
+        if os.path.exists(FONT_PATH):
+            pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+            print(f"INFO: Úspěšně zaregistrován font '{FONT_NAME}' z '{FONT_PATH}'.")
+            return FONT_NAME
+        print(f"ERROR: Soubor fontu '{FONT_PATH}' nebyl nalezen ve stejné složce jako skript.")
+        print("       Ujistěte se, že 'DejaVuSans.ttf' je přítomen.")
+        print("       PDF bude použito s výchozím fontem (může mít problémy s diakritikou).")
+    except Exception as e:
+        print(f"ERROR: Nepodařilo se zaregistrovat font z '{FONT_PATH}': {e}")
+        print("       PDF bude použito s výchozím fontem (může mít problémy s diakritikou).")
+    return 'Helvetica'
+
+# Styly odstavců karet podle názvu fontu (vytvářejí se jen jednou)
+_CARD_STYLES = {}
+
+def get_card_styles(font_name):
+    """Vrátí styly odstavců karet pro daný font."""
+    card_styles = _CARD_STYLES.get(font_name)
+    if card_styles is None:
+        styles = getSampleStyleSheet()
+        title_style = ParagraphStyle(name='CardTitle', parent=styles['h2'], alignment=TA_LEFT, textColor=navy, spaceAfter=8, fontName=font_name)
+        card_styles = {
+            'title': title_style,
+            'text': ParagraphStyle(name='CardText', parent=styles['Normal'], spaceAfter=8, leading=14, fontName=font_name),
+            'error': ParagraphStyle(name='CardTextError', parent=styles['Italic'], spaceAfter=4, textColor=red, fontName=font_name),
+        }
+        _CARD_STYLES[font_name] = card_styles
+    return card_styles
+
 class ResizableImage(Flowable):
     """ Vlastní Flowable pro obrázek, který se přizpůsobí šířce stránky. """
     def __init__(self, img_data, max_width, max_height=None, note_id=None,
-                 img_filename=None, err_log=None):
+                 img_filename=None, err_log=None, img_size=None, img_reader=None):
         self.img_data = img_data
         self.max_width = max_width
         self.max_height = max_height
@@ -75,16 +341,25 @@ class ResizableImage(Flowable):
         self._img_height = 0
         self.drawWidth = 0
         self.drawHeight = 0
-        try:
-            img_reader = ImageReader(io.BytesIO(self.img_data))
-            self._img_width, self._img_height = img_reader.getSize()
-        except Exception as e:
-            if err_log is not None:
-                log_error(self.note_id,
-                          f"obrázek '{self.img_filename}' - Nelze načíst rozměry: {e}")
-            else:
-                print(f"   WARN: Nelze načíst rozměry obrázku: {e}")
-        if self._img_width > 0 and self._img_height > 0:
+        self._reader = img_reader
+        if img_size and all(img_size):
+            # Rozměry již známe z IMAGE_CACHE, hlavičku obrázku není třeba znovu číst
+            self._img_width, self._img_height = img_size
+        else:
+            try:
+                if self._reader is None:
+                    self._reader = ImageReader(io.BytesIO(self.img_data))
+                self._img_width, self._img_height = self._reader.getSize()
+            except Exception as e:
+                if err_log is not None:
+                    log_error(self.note_id,
+                              f"obrázek '{self.img_filename}' - Nelze načíst rozměry: {e}")
+                else:
+                    print(f"   WARN: Nelze načíst rozměry obrázku: {e}")
+        size_key = (self.img_filename, self.max_width, self.max_height)
+        if self.img_filename is not None and size_key in DRAW_SIZE_CACHE:
+            self.drawWidth, self.drawHeight = DRAW_SIZE_CACHE[size_key]
+        elif self._img_width > 0 and self._img_height > 0:
             aspect_ratio = self._img_height / float(self._img_width)
             self.drawWidth = min(self.max_width, self._img_width)
             self.drawHeight = self.drawWidth * aspect_ratio
@@ -95,6 +370,8 @@ class ResizableImage(Flowable):
                  scale_factor = (A4[1] * 0.8) / self.drawHeight
                  self.drawHeight *= scale_factor
                  self.drawWidth *= scale_factor
+            if self.img_filename is not None:
+                DRAW_SIZE_CACHE[size_key] = (self.drawWidth, self.drawHeight)
         self.width = self.drawWidth
         self.height = self.drawHeight
 
@@ -102,8 +379,9 @@ class ResizableImage(Flowable):
         """ Vykreslí obrázek na plátno. """
         if self.width > 0 and self.height > 0:
             try:
-                img = Image(io.BytesIO(self.img_data), width=self.drawWidth, height=self.drawHeight)
-                img.drawOn(self.canv, 0, 0)
+                if self._reader is None:
+                    self._reader = ImageReader(io.BytesIO(self.img_data))
+                self.canv.drawImage(self._reader, 0, 0, self.drawWidth, self.drawHeight, mask='auto')
             except Exception as e:
                 if self.err_log is not None:
                     log_error(self.note_id,
@@ -111,46 +389,87 @@ class ResizableImage(Flowable):
                 else:
                     print(f"   ERROR: Chyba při vykreslování obrázku: {e}")
 
+class MissingImage(Flowable):
+    """ Jednořádková zpráva o chybějícím obrázku, vykreslená přímo bez parseru odstavců. """
+    def __init__(self, message, style):
+        self.message = message
+        self.style = style
+        self.spaceAfter = style.spaceAfter
+        self.width = 0
+        self.height = style.leading
+
+    def wrap(self, availWidth, availHeight):
+        # Příliš dlouhou zprávu (dlouhý název souboru) zkrátíme na šířku rámce
+        font_name, font_size = self.style.fontName, self.style.fontSize
+        if pdfmetrics.stringWidth(self.message, font_name, font_size) > availWidth:
+            message = self.message
+            while message and pdfmetrics.stringWidth(message + '…', font_name, font_size) > availWidth:
+                message = message[:-1]
+            self.message = message + '…'
+        self.width = availWidth
+        return self.width, self.height
+
+    def draw(self):
+        """ Vykreslí zprávu na plátno. """
+        self.canv.setFont(self.style.fontName, self.style.fontSize)
+        self.canv.setFillColor(self.style.textColor)
+        # Účaří stejně jako u prvního řádku odstavce
+        self.canv.drawString(0, self.height - self.style.fontSize, self.message)
+
+# Předkompilované regulární výrazy pro zpracování HTML polí Anki
+# Obsah značky za jejím názvem: hodnota atributu v uvozovkách může obsahovat i '>'.
+# Hodnota bez uvozovek sahá vždy až k mezeře nebo '>', aby se výraz nevracel (backtracking).
+_TAG_BODY = r"""(?:[^'"<>=]|=\s*(?:"[^"]*"|'[^']*'|[^\s"'>][^\s>]*(?=[\s>])))*"""
+_IMG_RE = re.compile(r"""<img\b""" + _TAG_BODY + r"""?(?<![\w-])src\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""",
+                     re.IGNORECASE)
+# Značka s neuzavřenou uvozovkou končí prvním '>'
+_TAG_RE = re.compile(r'</?[A-Za-z!](?:' + _TAG_BODY + r'>|[^>]*>)')
+_WS_RE = re.compile(r' +')
+# Obsah, který regulární výrazy nezpracují správně - použije se lxml
+_COMPLEX_RE = re.compile(r'<(?:script|style|!--)', re.IGNORECASE)
+
+def _parse_html_lxml(html_text):
+    """Zpracuje HTML pomocí lxml (pro pole se skripty, styly či komentáři)."""
+    root = lxml_html.fragment_fromstring(html_text, create_parent='div')
+    img_filenames = [img.get('src') for img in root.iter('img') if img.get('src')]
+    # Obsah skriptů, stylů a komentáře do textu karty nepatří
+    for element in root.xpath('.//script | .//style | .//comment()'):
+        # drop_tree() připojí text za prvkem k předchozímu textu - zachováme oddělení
+        element.tail = '\n' + (element.tail or '')
+        element.drop_tree()
+    # Každý textový uzel na vlastní řádek (<br>, <img> i ostatní značky text oddělují)
+    return '\n'.join(root.itertext()), img_filenames
+
 def parse_html_content(html_text):
     """Analyzuje HTML obsah pole, extrahuje text a názvy obrázkových souborů."""
     if not html_text:
         return "", []
     try:
-        from bs4 import BeautifulSoup
-        soup = BeautifulSoup(html_text, 'html.parser')
+        if lxml_html is not None and _COMPLEX_RE.search(html_text):
+            text_content, img_filenames = _parse_html_lxml(html_text)
+        else:
+            img_filenames = [html.unescape(next(src for src in m.groups() if src is not None))
+                             for m in _IMG_RE.finditer(html_text)]
+            img_filenames = [src for src in img_filenames if src]
+            # Každá značka odděluje textové uzly, stejně jako get_text(separator='\n')
+            text_content = html.unescape(_TAG_RE.sub('\n', html_text))
     except Exception as e:
         print(f"   WARN: Chyba při parsování HTML: {e}. Obsah pole: {html_text[:100]}...")
         return html_text, []
-    img_filenames = []
-    for img_tag in soup.find_all('img'):
-        src = img_tag.get('src')
-        if src:
-            img_filenames.append(src)
-        img_tag.decompose()
-    placeholder = "||NEWLINE||"
-    for br in soup.find_all('br'):
-        br.insert_after(placeholder)
-        br.decompose()
-    text_content = soup.get_text(separator='\n', strip=True)
-    text_content = text_content.replace(placeholder, '\n')
     lines = (line.strip() for line in text_content.splitlines())
     cleaned_text = '\n'.join(line for line in lines if line)
-    cleaned_text = re.sub(r' +', ' ', cleaned_text)
+    cleaned_text = _WS_RE.sub(' ', cleaned_text)
     return cleaned_text, img_filenames
 
 # --- Funkce pro AnkiConnect ---
 
-def anki_request(action, **params):
-    """ Odešle požadavek na AnkiConnect a vrátí výsledek. """
-    payload = json.dumps({"action": action, "version": ANKICONNECT_VERSION, "params": params})
+def _anki_post(action, params):
+    """ Odešle požadavek na AnkiConnect a vrátí surové tělo odpovědi (bytes) nebo None. """
+    payload = _json_dumps({"action": action, "version": ANKICONNECT_VERSION, "params": params})
     try:
-        response = requests.post(ANKICONNECT_URL, data=payload)
+        response = _SESSION.post(ANKICONNECT_URL, data=payload, timeout=ANKICONNECT_TIMEOUT)
         response.raise_for_status()
-        response_json = response.json()
-        if 'error' in response_json and response_json['error'] is not None:
-            print(f"ERROR: Chyba AnkiConnect API ({action}): {response_json['error']}")
-            return None
-        return response_json.get('result')
+        return response.content
     except requests.exceptions.ConnectionError:
         print(f"ERROR: Nepodařilo se připojit k AnkiConnect na {ANKICONNECT_URL}.")
         print("       Ujistěte se, že Anki běží a doplněk AnkiConnect je nainstalován a aktivní.")
@@ -158,33 +477,275 @@ def anki_request(action, **params):
     except requests.exceptions.RequestException as e:
         print(f"ERROR: Chyba při komunikaci s AnkiConnect ({action}): {e}")
         return None
-    except json.JSONDecodeError:
-        print(f"ERROR: AnkiConnect vrátil neplatnou JSON odpověď pro akci '{action}'. Obsah: {response.text[:200]}...")
+
+def _anki_result(action, content, lazy=False):
+    """ Dekóduje JSON odpověď AnkiConnect a vrátí její výsledek (None při chybě).
+
+    S ``lazy=True`` a nainstalovaným pysimdjson vrací líné proxy objekty jen pro
+    čtení - slovníky a seznamy Pythonu se vytváří až pro pole, která se opravdu čtou.
+    """
+    try:
+        if lazy and simdjson is not None:
+            # Parser nelze sdílet mezi vlákny ani znovu použít, dokud žijí proxy
+            # objekty předchozího dokumentu - každá odpověď má vlastní
+            response_json = simdjson.Parser().parse(content)
+        else:
+            response_json = _json_loads(content)
+    except ValueError:  # json.JSONDecodeError i chyby pysimdjson
+        print(f"ERROR: AnkiConnect vrátil neplatnou JSON odpověď pro akci '{action}'. Obsah: {content[:200]}...")
+        return None
+    if 'error' in response_json and response_json['error'] is not None:
+        print(f"ERROR: Chyba AnkiConnect API ({action}): {response_json['error']}")
+        return None
+    return response_json.get('result')
+
+def anki_request(action, **params):
+    """ Odešle požadavek na AnkiConnect a vrátí výsledek. """
+    content = _anki_post(action, params)
+    if content is None:
+        return None
+    return _anki_result(action, content)
+
+def fetch_cards_info(card_ids):
+    """ Načte 'cardsInfo' pro dávku karet (s pysimdjson jako líné proxy objekty). """
+    content = _anki_post('cardsInfo', {"cards": card_ids})
+    if content is None:
+        return None
+    return _anki_result('cardsInfo', content, lazy=True)
+
+def _unwrap_multi_results(actions, results):
+    """ Převede výsledky akce 'multi' na seznam hodnot (None u akcí, které selhaly). """
+    unwrapped = []
+    for action, result in zip(actions, results):
+        # Akce s vlastním "version" (>= 6) vrací {"result": ..., "error": ...}, jinak jen hodnotu
+        if isinstance(result, dict) and 'error' in result:
+            if result['error'] is not None:
+                print(f"   WARN: Chyba AnkiConnect API ({action['action']}): {result['error']}")
+                result = None
+            else:
+                result = result.get('result')
+        unwrapped.append(result)
+    return unwrapped
+
+# Výsledek jedné akce retrieveMediaFile v odpovědi 'multi': base64 řetězec, false nebo null
+_MEDIA_RESULT_RE = re.compile(rb'"result"\s*:\s*(?:"([A-Za-z0-9+/=]*)"|false|null)')
+
+def retrieve_media_files(filenames):
+    """Načte mediální soubory jedním požadavkem 'multi' a vrátí jejich obsah v base64.
+
+    Base64 data se z odpovědi vyřezávají přímo jako ``memoryview`` nad jejími
+    bajty, takže se velké obrázky nekopírují do řetězců JSON parseru. Pokud
+    odpověď nemá očekávaný tvar, použije se běžné JSON dekódování.
+    """
+    # Verze u každé akce zajistí výsledky ve tvaru {"result": ..., "error": ...},
+    # na který spoléhá rychlé vyřezávání base64 dat
+    actions = [{"action": "retrieveMediaFile", "version": ANKICONNECT_VERSION, "params": {"filename": fn}}
+               for fn in filenames]
+    content = _anki_post('multi', {"actions": actions})
+    if content is None:
+        return None
+    # Vnější výsledek akce 'multi' je seznam - hledáme až za jeho začátkem
+    start = content.find(b'[')
+    matches = list(_MEDIA_RESULT_RE.finditer(content, start)) if start >= 0 else []
+    if len(matches) != len(filenames):
+        results = _anki_result('multi', content)
+        return None if results is None else _unwrap_multi_results(actions, results)
+    view = memoryview(content)
+    return [view[m.start(1):m.end(1)] if m.group(1) else None for m in matches]
+
+def get_media_dir():
+    """Vrátí cestu ke složce collection.media, pokud je dostupná z tohoto počítače.
+
+    Cesta se od AnkiConnect zjišťuje jen jednou; při chybě nebo pokud složka
+    lokálně neexistuje (vzdálený AnkiConnect), vrací ``None``.
+    """
+    global _media_dir
+    if _media_dir is _MEDIA_DIR_UNKNOWN:
+        path = anki_request('getMediaDirPath')
+        _media_dir = path if isinstance(path, str) and os.path.isdir(path) else None
+        if _media_dir:
+            print(f"INFO: Mediální soubory čtu přímo ze složky '{_media_dir}'.")
+    return _media_dir
+
+def read_local_media(filename):
+    """Načte mediální soubor přímo ze složky collection.media, nebo vrátí ``None``."""
+    media_dir = get_media_dir()
+    # Jen prosté názvy souborů - žádné cesty mimo složku médií
+    if not media_dir or os.path.basename(filename) != filename or filename in ('', '.', '..'):
+        return None
+    try:
+        with open(os.path.join(media_dir, filename), 'rb') as f:
+            return f.read()
+    except OSError:
         return None
 
-def get_media_data(filename, note_id=None, quality=DEFAULT_IMAGE_QUALITY):
-    """Získá binární data mediálního souboru přes AnkiConnect s cachingem a případnou kompresí."""
-    if filename in IMAGE_CACHE:
-        return IMAGE_CACHE[filename]
-    result = anki_request('retrieveMediaFile', filename=filename)
+def _fetch_and_compress(batch, quality, compress_options):
+    """Načte dávku mediálních souborů, dekóduje je a uloží (zkomprimované) do IMAGE_CACHE.
+
+    Soubory se nejprve čtou přímo z disku, přes AnkiConnect se stahují jen ostatní.
+    Vrací slovník název souboru -> položka IMAGE_CACHE pro úspěšně načtené soubory.
+    """
+    entries = {}
+    remote = []
+    for filename in batch:
+        data = read_local_media(filename)
+        if data is None:
+            remote.append(filename)
+            continue
+        if quality is not None:
+            data = compress_image(data, quality=quality, **compress_options)
+        entries[filename] = cache_media(filename, data)
+    if not remote:
+        return entries
+    results = retrieve_media_files(remote)
+    if results is None:
+        print(f"WARN: Nepodařilo se načíst dávku mediálních souborů: {remote[:5]}...")
+        return entries
+    for filename, result in zip(remote, results):
+        if not result:
+            MISSING_MEDIA.add(filename)
+            continue
+        try:
+            # Dekodér přijímá memoryview i str bez kopírování do bytes
+            data = _b64decode(result)
+        except (TypeError, ValueError) as e:
+            print(f"   ERROR: Chyba při dekódování base64 dat pro soubor '{filename}': {e}")
+            MISSING_MEDIA.add(filename)
+            continue
+        if quality is not None:
+            data = compress_image(data, quality=quality, **compress_options)
+        entries[filename] = cache_media(filename, data)
+    return entries
+
+def prefetch_media(filenames, quality=DEFAULT_IMAGE_QUALITY, **compress_options):
+    """Spustí paralelní načítání zadaných mediálních souborů po dávkách do IMAGE_CACHE.
+
+    Funkce nečeká na dokončení - vrací slovník název souboru -> ``Future`` jeho
+    dávky (nebo rovnou položka IMAGE_CACHE, je-li soubor již v cache), na který
+    stačí počkat (:func:`wait_for_media`) až ve chvíli, kdy je obrázek potřeba.
+    Slovník drží načtené položky, dokud ho volající drží, takže je pozdější
+    vyřazení z cache nevynutí načíst znovu. Dávky se plánují v pořadí
+    ``filenames``, takže soubory potřebné dříve jsou k dispozici dříve. Další
+    pojmenované argumenty se předávají do :func:`compress_image`.
+    """
+    pending = {}
+    missing = []
+    for fn in dict.fromkeys(filenames):
+        if fn in MISSING_MEDIA:
+            continue
+        entry = cached_media(fn)
+        if entry is not None:
+            pending[fn] = entry
+        else:
+            missing.append(fn)
+    if not missing:
+        return pending
+    print(f"INFO: Načítám {len(missing)} mediálních souborů...")
+    get_media_dir()  # Zjistíme jednou předem, ne souběžně ve vláknech
+    # Dávky rozdělíme tak, aby se práce rozložila mezi všechna vlákna
+    batch_size = max(1, min(MEDIA_BATCH_SIZE, -(-len(missing) // MEDIA_WORKERS)))
+    pool = ThreadPoolExecutor(max_workers=MEDIA_WORKERS)
+    for i in range(0, len(missing), batch_size):
+        batch = missing[i:i+batch_size]
+        future = pool.submit(_fetch_and_compress, batch, quality, compress_options)
+        pending.update(dict.fromkeys(batch, future))
+    # Vlákna doběhnou na pozadí, další úlohy už nepřijímáme
+    pool.shutdown(wait=False)
+    return pending
+
+def wait_for_media(pending, filename):
+    """Počká na dokončení dávky, ve které se načítá daný soubor (viz :func:`prefetch_media`).
+
+    Vrací položku IMAGE_CACHE, nebo ``None``, pokud se soubor předem načíst nepodařilo.
+    """
+    item = pending.get(filename)
+    if not isinstance(item, Future):
+        return item
+    try:
+        return item.result().get(filename)
+    except Exception as e:
+        # Soubor se pak načte samostatně v get_media_data()
+        print(f"   WARN: Předběžné načtení souboru '{filename}' selhalo: {e}")
+        return None
+
+def get_media_data(filename, note_id=None, quality=DEFAULT_IMAGE_QUALITY, **compress_options):
+    """Získá binární data mediálního souboru (z disku nebo přes AnkiConnect) s cachingem a případnou kompresí.
+
+    Vrací položku IMAGE_CACHE (slovník s klíči ``data``, ``w``, ``h`` a ``reader``) nebo ``None``.
+    Soubory načtené předem pomocí :func:`prefetch_media` se vrací přímo z cache,
+    jednotlivý požadavek se odesílá jen pro chybějící položky. Další pojmenované
+    argumenty se předávají do :func:`compress_image`. Soubory, které se načíst
+    nepodařilo, si pamatujeme v MISSING_MEDIA a znovu se nevyžadují.
+    """
+    entry = cached_media(filename)
+    if entry is not None:
+        return entry
+    if filename in MISSING_MEDIA:
+        return None
+    data = read_local_media(filename)
+    if data is not None:
+        if quality is not None:
+            data = compress_image(data, quality=quality, **compress_options)
+        return cache_media(filename, data)
+    results = retrieve_media_files([filename])
+    if results is None:
+        return None  # Chyba komunikace - soubor nevyřazujeme, může se podařit později
+    result = results[0]
     if result:
         try:
-            data = base64.b64decode(result)
+            data = _b64decode(result)
             if quality is not None:
-                data = compress_image(data, quality=quality)
-            IMAGE_CACHE[filename] = data
-            return data
+                data = compress_image(data, quality=quality, **compress_options)
+            return cache_media(filename, data)
         except (TypeError, ValueError) as e:
             if note_id is not None:
                 log_error(note_id,
                           f"obrázek '{filename}' - Chyba při dekódování base64: {e}")
             else:
                 print(f"   ERROR: Chyba při dekódování base64 dat pro soubor '{filename}': {e}")
-            return None
+    MISSING_MEDIA.add(filename)
     return None
 
 # --- Hlavní Logika ---
 
+def _extract_cards_batch(cards_info, batch_ids, extracted_notes, model_field_cache):
+    """Zpracuje jednu dávku výsledků 'cardsInfo' a doplní poznámky do extracted_notes."""
+    if not cards_info:
+        print(f"WARN: Nepodařilo se získat informace pro dávku karet ID: {batch_ids[:5]}...")
+        return
+    for card_info in cards_info:
+        note_id = card_info.get('note')
+        fields_data = card_info.get('fields', {})
+        if not note_id or not fields_data:
+            print(f"WARN: Chybí note ID nebo data polí pro kartu ID {card_info.get('cardId')}")
+            continue
+        if note_id not in extracted_notes:
+             model_name = card_info.get('modelName')
+             if model_name in model_field_cache:
+                 q_field_name, a_field_name = model_field_cache[model_name]
+             else:
+                 field_names_lower = {name.lower(): name for name in fields_data}
+                 q_field_name = next((field_names_lower[n] for n in _Q_FIELDS if n in field_names_lower), None)
+                 a_field_name = next((field_names_lower[n] for n in _A_FIELDS if n in field_names_lower), None)
+                 if model_name is not None:
+                     model_field_cache[model_name] = (q_field_name, a_field_name)
+             if q_field_name and a_field_name:
+                 q_html = fields_data.get(q_field_name, {}).get('value', '')
+                 a_html = fields_data.get(a_field_name, {}).get('value', '')
+                 q_text, q_img_files = parse_html_content(q_html)
+                 a_text, a_img_files = parse_html_content(a_html)
+                 extracted_notes[note_id] = {
+                     "note_id": note_id,
+                     "model_name": card_info.get('modelName', 'Neznámý model'),
+                     "q_text": q_text,
+                     "q_images": q_img_files,
+                     "a_text": a_text,
+                     "a_images": a_img_files,
+                 }
+             else:
+                 print(f"   WARN: Pro poznámku ID {note_id} (model '{card_info.get('modelName')}') se nepodařilo najít pole pro Otázku/Odpověď.")
+                 print(f"         Dostupná pole: {list(fields_data.keys())}")
+
 def extract_anki_data_connect(deck_name):
     """ Extrahuje data kartiček pro daný balíček pomocí AnkiConnect. """
     print(f"INFO: Získávám data pro balíček '{deck_name}' pomocí AnkiConnect...")
@@ -200,51 +761,24 @@ def extract_anki_data_connect(deck_name):
     print(f"INFO: Nalezeno {len(card_ids)} karet v balíčku.")
     batch_size = 100
     extracted_notes = {}
-    for i in range(0, len(card_ids), batch_size):
-        batch_ids = card_ids[i:i+batch_size]
-        print(f"INFO: Zpracovávám dávku karet {i+1}-{min(i+batch_size, len(card_ids))}...")
-        cards_info = anki_request('cardsInfo', cards=batch_ids)
-        if not cards_info:
-            print(f"WARN: Nepodařilo se získat informace pro dávku karet ID: {batch_ids[:5]}...")
-            continue
-        for card_info in cards_info:
-            note_id = card_info.get('note')
-            fields_data = card_info.get('fields', {})
-            if not note_id or not fields_data:
-                print(f"WARN: Chybí note ID nebo data polí pro kartu ID {card_info.get('cardId')}")
-                continue
-            if note_id not in extracted_notes:
-                 q_field_name = None
-                 a_field_name = None
-                 field_names_lower = {name.lower(): name for name in fields_data.keys()}
-                 for name in QUESTION_FIELD_NAMES:
-                     if name in field_names_lower:
-                         q_field_name = field_names_lower[name]
-                         break
-                 for name in ANSWER_FIELD_NAMES:
-                      if name in field_names_lower:
-                         a_field_name = field_names_lower[name]
-                         break
-                 if q_field_name and a_field_name:
-                     q_html = fields_data.get(q_field_name, {}).get('value', '')
-                     a_html = fields_data.get(a_field_name, {}).get('value', '')
-                     q_text, q_img_files = parse_html_content(q_html)
-                     a_text, a_img_files = parse_html_content(a_html)
-                     extracted_notes[note_id] = {
-                         "note_id": note_id,
-                         "model_name": card_info.get('modelName', 'Neznámý model'),
-                         "q_text": q_text,
-                         "q_images": q_img_files,
-                         "a_text": a_text,
-                         "a_images": a_img_files,
-                     }
-                 else:
-                     print(f"   WARN: Pro poznámku ID {note_id} (model '{card_info.get('modelName')}') se nepodařilo najít pole pro Otázku/Odpověď.")
-                     print(f"         Dostupná pole: {list(fields_data.keys())}")
+    # Všechny poznámky jednoho modelu mají stejná pole: název modelu -> (pole otázky, pole odpovědi)
+    model_field_cache = {}
+    # Další dávku stahujeme na pozadí, zatímco se zpracovává HTML té předchozí
+    with ThreadPoolExecutor(max_workers=1) as fetcher:
+        next_batch = fetcher.submit(fetch_cards_info, card_ids[0:batch_size])
+        for i in range(0, len(card_ids), batch_size):
+            batch_ids = card_ids[i:i+batch_size]
+            cards_info = next_batch.result()
+            if i + batch_size < len(card_ids):
+                next_batch = fetcher.submit(fetch_cards_info, card_ids[i+batch_size:i+2*batch_size])
+            print(f"INFO: Zpracovávám dávku karet {i+1}-{min(i+batch_size, len(card_ids))}...")
+            _extract_cards_batch(cards_info, batch_ids, extracted_notes, model_field_cache)
     print(f"INFO: Načtena data pro {len(extracted_notes)} unikátních poznámek.")
     return list(extracted_notes.values())
 
-def create_pdf_connect(cards_data, output_pdf_path, ocr_lang="ces", force_ocr=False, image_quality=DEFAULT_IMAGE_QUALITY):
+def create_pdf_connect(cards_data, output_pdf_path, ocr_lang="ces", force_ocr=False, image_quality=DEFAULT_IMAGE_QUALITY,
+                       jpeg_progressive=DEFAULT_JPEG_PROGRESSIVE, jpeg_subsampling=DEFAULT_JPEG_SUBSAMPLING,
+                       ocr_jobs=None):
     """Vytvoří PDF soubor z extrahovaných dat kartiček a případně spustí OCR.
 
     Parametry
@@ -259,119 +793,145 @@ def create_pdf_connect(cards_data, output_pdf_path, ocr_lang="ces", force_ocr=Fa
         Pokud je ``True``, OCR proběhne i na stránkách s existujícím textem.
     image_quality : int, optional
         Kvalita JPEG komprese (1-95) pro vložené obrázky. Hodnota ``None`` vypne kompresi.
+    jpeg_progressive : bool, optional
+        Ukládat zkomprimované obrázky jako progresivní JPEG.
+    jpeg_subsampling : int, optional
+        Podvzorkování barev JPEG (0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0).
+    ocr_jobs : int, optional
+        Počet paralelních úloh OCR. ``None`` použije všechna jádra CPU.
     """
     if not cards_data:
         print("INFO: Nebyla nalezena žádná data kartiček pro generování PDF.")
         return
 
     print(f"INFO: Generuji PDF: {output_pdf_path}")
+    if image_quality is not None and image_backend_name():
+        print(f"INFO: Komprese obrázků: {image_backend_name()}")
     try:
-        # --- Registrace TTF fontu s podporou UTF-8 ---
-        font_path = 'DejaVuSans.ttf'  # Předpokládáme, že DejaVuSans.ttf je ve stejné složce
-        font_name = 'DejaVu'        # Jméno, pod kterým budeme font používat
+        # Stahování obrázků spustíme hned - poběží paralelně s registrací fontu,
+        # přípravou dokumentu a stavbou odstavců; na každý čekáme až při použití
+        available_width = A4[0] - 2 * PAGE_MARGIN
+        # Šířka obrázku v pixelech, která při IMAGE_DPI zaplní dostupnou šířku (body -> palce -> px)
+        target_px_width = int(available_width * 0.9 / 72 * IMAGE_DPI)
+        compress_options = {
+            'target_px_width': target_px_width,
+            'progressive': jpeg_progressive,
+            'subsampling': jpeg_subsampling,
+        }
+        # Soubory v pořadí prvního použití - dávky pro první karty se načtou nejdříve
+        pending_media = prefetch_media(dict.fromkeys(fn for card in cards_data
+                                                     for fn in card['q_images'] + card['a_images']),
+                                       quality=image_quality, **compress_options)
 
-        default_font = 'Helvetica' # Výchozí, pokud se registrace nepodaří
-        try:
-            if os.path.exists(font_path):
-                pdfmetrics.registerFont(TTFont(font_name, font_path))
-                print(f"INFO: Úspěšně zaregistrován font '{font_name}' z '{font_path}'.")
-                default_font = font_name # Nastavíme DejaVu jako výchozí
-            else:
-                print(f"ERROR: Soubor fontu '{font_path}' nebyl nalezen ve stejné složce jako skript.")
-                print("       Ujistěte se, že 'DejaVuSans.ttf' je přítomen.")
-                print("       PDF bude použito s výchozím fontem (může mít problémy s diakritikou).")
-        except Exception as e:
-            print(f"ERROR: Nepodařilo se zaregistrovat font z '{font_path}': {e}")
-            print("       PDF bude použito s výchozím fontem (může mít problémy s diakritikou).")
-        # --- Konec registrace fontu ---
-
-        doc = SimpleDocTemplate(output_pdf_path, pagesize=A4,
-                                leftMargin=1.5*cm, rightMargin=1.5*cm,
-                                topMargin=1.5*cm, bottomMargin=1.5*cm)
-        styles = getSampleStyleSheet()
+        # Registrace TTF fontu s podporou UTF-8 (nebo výchozí, pokud selže)
+        default_font = register_card_font()
+
+        # Jediná šablona stránky s jedním rámem - dokument se sestaví v jednom průchodu
+        doc = BaseDocTemplate(output_pdf_path, pagesize=A4,
+                              leftMargin=PAGE_MARGIN, rightMargin=PAGE_MARGIN,
+                              topMargin=PAGE_MARGIN, bottomMargin=PAGE_MARGIN,
+                              _pageBreakQuick=1)
+        doc.addPageTemplates([PageTemplate(id='Card', frames=[
+            Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='normal')])])
         story = []
 
         # Vlastní styly - NASTAVÍME NÁŠ FONT (nebo výchozí, pokud selhalo)
-        title_style = ParagraphStyle(name='CardTitle', parent=styles['h2'], alignment=TA_LEFT, textColor=navy, spaceAfter=8, fontName=default_font)
-        text_style = ParagraphStyle(name='CardText', parent=styles['Normal'], spaceAfter=8, leading=14, fontName=default_font)
-        text_style_error = ParagraphStyle(name='CardTextError', parent=styles['Italic'], spaceAfter=4, textColor=red, fontName=default_font)
+        card_styles = get_card_styles(default_font)
+        title_style = card_styles['title']
+        text_style = card_styles['text']
+        text_style_error = card_styles['error']
 
-        available_width = doc.width
+        embedded_images = 0
 
         for i, card in enumerate(cards_data):
+            # Prvky karty sbíráme zvlášť a do příběhu je přidáme najednou.
+            # Každá karta má vlastní instance - ReportLab si u prvku, který se nevešel
+            # na stránku, trvale nastaví příznak _postponed a sdílený prvek by selhal.
+            card_flows = []
             # --- Otázka ---
-            story.append(Paragraph("Otázka:", title_style))
+            card_flows.append(Paragraph("Otázka:", title_style))
             if card['q_text']:
-                text_with_br = card['q_text'].replace('\n', '<br/>')
                 try:
                     # Správné escapování pro XML v ReportLab
-                    safe_text = text_with_br.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                    story.append(Paragraph(safe_text, text_style))
+                    safe_text = card['q_text'].translate(_PARAGRAPH_ESCAPE)
+                    card_flows.append(Paragraph(safe_text, text_style))
                 except ValueError as e:
                      print(f"   ERROR: Chyba ReportLab při zpracování odstavce (otázka) ID {card.get('note_id')}: {e}")
-                     print(f"          Původní text (zkráceno): {text_with_br[:200]}...")
-                     story.append(Paragraph("[Chyba formátování textu otázky]", text_style_error))
+                     print(f"          Původní text (zkráceno): {card['q_text'][:200]}...")
+                     card_flows.append(Paragraph("[Chyba formátování textu otázky]", text_style_error))
             else:
-                story.append(Paragraph("[Prázdná otázka]", text_style_error))
+                card_flows.append(Paragraph("[Prázdná otázka]", text_style_error))
 
             # Obrázky k otázce
             for img_filename in card['q_images']:
                 print(f"   INFO: Načítám médium (Q): {img_filename}")
-                img_data = get_media_data(img_filename, note_id=card.get('note_id'), quality=image_quality)
-                if img_data:
-                    res_img = ResizableImage(img_data, max_width=available_width * 0.9,
+                media = wait_for_media(pending_media, img_filename)
+                if media is None:
+                    media = get_media_data(img_filename, note_id=card.get('note_id'), quality=image_quality,
+                                           **compress_options)
+                if media:
+                    res_img = ResizableImage(media['data'], max_width=available_width * 0.9,
                                            note_id=card.get('note_id'),
                                            img_filename=img_filename,
-                                           err_log=error_log)
+                                           err_log=error_log,
+                                           img_size=(media['w'], media['h']),
+                                           img_reader=media['reader'])
                     if res_img.width > 0 :
-                         story.append(res_img)
-                         story.append(Spacer(1, 0.2*cm))
+                         card_flows.append(res_img)
+                         card_flows.append(Spacer(1, 0.2*cm))
+                         embedded_images += 1
                     else:
-                         story.append(Paragraph(f"[Obrázek '{img_filename}' nelze zobrazit]", text_style_error))
+                         card_flows.append(MissingImage(f"[Obrázek '{img_filename}' nelze zobrazit]", text_style_error))
                 else:
                      log_error(card.get('note_id'),
                                f"obrázek '{img_filename}' - Nepodařilo se načíst data přes AnkiConnect")
-                     story.append(Paragraph(f"[Obrázek '{img_filename}' se nepodařilo načíst]", text_style_error))
+                     card_flows.append(MissingImage(f"[Obrázek '{img_filename}' se nepodařilo načíst]", text_style_error))
 
-            story.append(Spacer(1, 0.6*cm))
+            card_flows.append(Spacer(1, 0.6*cm))
 
             # --- Odpověď ---
-            story.append(Paragraph("Odpověď:", title_style))
+            card_flows.append(Paragraph("Odpověď:", title_style))
             if card['a_text']:
-                text_with_br = card['a_text'].replace('\n', '<br/>')
                 try:
                     # Správné escapování pro XML v ReportLab
-                    safe_text = text_with_br.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-                    story.append(Paragraph(safe_text, text_style))
+                    safe_text = card['a_text'].translate(_PARAGRAPH_ESCAPE)
+                    card_flows.append(Paragraph(safe_text, text_style))
                 except ValueError as e:
                      print(f"   ERROR: Chyba ReportLab při zpracování odstavce (odpověď) ID {card.get('note_id')}: {e}")
-                     print(f"          Původní text (zkráceno): {text_with_br[:200]}...")
-                     story.append(Paragraph("[Chyba formátování textu odpovědi]", text_style_error))
+                     print(f"          Původní text (zkráceno): {card['a_text'][:200]}...")
+                     card_flows.append(Paragraph("[Chyba formátování textu odpovědi]", text_style_error))
             else:
-                 story.append(Paragraph("[Prázdná odpověď]", text_style_error))
+                 card_flows.append(Paragraph("[Prázdná odpověď]", text_style_error))
 
              # Obrázky k odpovědi
             for img_filename in card['a_images']:
                 print(f"   INFO: Načítám médium (A): {img_filename}")
-                img_data = get_media_data(img_filename, note_id=card.get('note_id'), quality=image_quality)
-                if img_data:
-                    res_img = ResizableImage(img_data, max_width=available_width * 0.9,
+                media = wait_for_media(pending_media, img_filename)
+                if media is None:
+                    media = get_media_data(img_filename, note_id=card.get('note_id'), quality=image_quality,
+                                           **compress_options)
+                if media:
+                    res_img = ResizableImage(media['data'], max_width=available_width * 0.9,
                                            note_id=card.get('note_id'),
                                            img_filename=img_filename,
-                                           err_log=error_log)
+                                           err_log=error_log,
+                                           img_size=(media['w'], media['h']),
+                                           img_reader=media['reader'])
                     if res_img.width > 0:
-                         story.append(res_img)
-                         story.append(Spacer(1, 0.2*cm))
+                         card_flows.append(res_img)
+                         card_flows.append(Spacer(1, 0.2*cm))
+                         embedded_images += 1
                     else:
-                         story.append(Paragraph(f"[Obrázek '{img_filename}' nelze zobrazit]", text_style_error))
+                         card_flows.append(MissingImage(f"[Obrázek '{img_filename}' nelze zobrazit]", text_style_error))
                 else:
                      log_error(card.get('note_id'),
                                f"obrázek '{img_filename}' - Nepodařilo se načíst data přes AnkiConnect")
-                     story.append(Paragraph(f"[Obrázek '{img_filename}' se nepodařilo načíst]", text_style_error))
+                     card_flows.append(MissingImage(f"[Obrázek '{img_filename}' se nepodařilo načíst]", text_style_error))
 
             # Oddělovač
             if i < len(cards_data) - 1:
-                 story.append(PageBreak())
+                 card_flows.append(PageBreak())
+            story.extend(card_flows)
 
         # Sestavení PDF
         doc.build(story)
@@ -386,7 +946,13 @@ def create_pdf_connect(cards_data, output_pdf_path, ocr_lang="ces", force_ocr=Fa
             print(f"INFO: Seznam problémových karet uložen do: {log_path}")
 
         # Spustit OCR, pokud je dostupná knihovna ocrmypdf
-        apply_ocr_to_pdf(output_pdf_path, lang=ocr_lang, force=force_ocr)
+        # Veškerý text PDF je skutečný text - OCR má smysl jen pro text v obrázcích
+        if not embedded_images and not force_ocr:
+            print("INFO: PDF neobsahuje žádné obrázky, OCR bude přeskočeno.")
+            return
+        # Obrázky už jsme zkomprimovali - ocrmypdf je nemusí znovu ztrátově optimalizovat
+        apply_ocr_to_pdf(output_pdf_path, lang=ocr_lang, force=force_ocr, jobs=ocr_jobs,
+                         optimize=1 if image_quality is not None else 3)
 
     except Exception as e:
         print(f"ERROR: Neočekávaná chyba při generování PDF: {e}")
@@ -394,7 +960,7 @@ def create_pdf_connect(cards_data, output_pdf_path, ocr_lang="ces", force_ocr=Fa
         traceback.print_exc()
 
 
-def apply_ocr_to_pdf(pdf_path, lang="ces", force=False):
+def apply_ocr_to_pdf(pdf_path, lang="ces", force=False, jobs=None, optimize=3):
     """Spustí OCR nad zadaným PDF a výsledek uloží zpět.
 
     Parametry
@@ -405,6 +971,11 @@ def apply_ocr_to_pdf(pdf_path, lang="ces", force=False):
         Jazyk nebo kombinace jazyků pro Tesseract (např. "ces+chi_sim").
     force : bool, optional
         Pokud je ``True``, OCR proběhne i na stránkách, které již obsahují text.
+    jobs : int, optional
+        Počet paralelně zpracovávaných stránek. ``None`` použije všechna jádra CPU.
+    optimize : int, optional
+        Úroveň optimalizace výstupu ocrmypdf (0-3). Obrázky již zkomprimované
+        tímto skriptem stačí optimalizovat bezeztrátově (1).
     """
     try:
         import ocrmypdf
@@ -420,18 +991,19 @@ def apply_ocr_to_pdf(pdf_path, lang="ces", force=False):
         pass
 
     temp_output = pdf_path + ".ocr.tmp.pdf"
+    ocr_options = {
+        'language': lang,
+        'skip_text': False,
+        'optimize': optimize,
+        'output_type': "pdf",
+        'jobs': jobs or os.cpu_count(),
+        'tesseract_oem': 1,  # Pouze LSTM engine - rychlejší než kombinace s legacy
+        'fast_web_view': 999999,  # Vysoký práh (MB) vypne linearizaci výstupu
+    }
     try:
         # Run OCR on all pages so text embedded in images is also recognized
         # while keeping the output optimized.
-        ocrmypdf.ocr(
-            pdf_path,
-            temp_output,
-            language=lang,
-            skip_text=False,
-            force_ocr=force,
-            optimize=3,
-            output_type="pdf",
-        )
+        ocrmypdf.ocr(pdf_path, temp_output, force_ocr=force, **ocr_options)
         os.replace(temp_output, pdf_path)
         print(f"INFO: OCR dokončeno: {pdf_path}")
     except Exception as e:
@@ -439,15 +1011,7 @@ def apply_ocr_to_pdf(pdf_path, lang="ces", force=False):
         if "page already has text" in str(e).lower() and not force:
             print("INFO: PDF již obsahuje text. Opakuji OCR s volbou --force-ocr.")
             try:
-                ocrmypdf.ocr(
-                    pdf_path,
-                    temp_output,
-                    language=lang,
-                    skip_text=False,
-                    force_ocr=True,
-                    optimize=3,
-                    output_type="pdf",
-                )
+                ocrmypdf.ocr(pdf_path, temp_output, force_ocr=True, **ocr_options)
                 os.replace(temp_output, pdf_path)
                 print(f"INFO: OCR dokončeno s --force-ocr: {pdf_path}")
                 return
@@ -474,23 +1038,34 @@ def main():
         action="store_true",
         help="Vynutit OCR i na stránkách, které již obsahují text.",
     )
+    parser.add_argument(
+        "--ocr-jobs",
+        type=int,
+        default=None,
+        help="Počet paralelních úloh OCR (výchozí: počet jader CPU).",
+    )
     parser.add_argument(
         "--image-quality",
         type=int,
         default=DEFAULT_IMAGE_QUALITY,
         help="Kvalita JPEG komprese pro obrázky (1-95). Hodnota 0 vypne kompresi.",
     )
+    parser.add_argument(
+        "--progressive",
+        action=argparse.BooleanOptionalAction,
+        default=DEFAULT_JPEG_PROGRESSIVE,
+        help="Ukládat obrázky jako progresivní JPEG.",
+    )
+    parser.add_argument(
+        "--subsampling",
+        type=int,
+        choices=(0, 1, 2),
+        default=DEFAULT_JPEG_SUBSAMPLING,
+        help="Podvzorkování barev JPEG: 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0.",
+    )
 
     args = parser.parse_args()
 
-    # Zkontrolujeme, zda je nainstalována BeautifulSoup
-    try:
-        from bs4 import BeautifulSoup
-    except ImportError:
-        print("ERROR: Knihovna 'BeautifulSoup4' není nainstalována.")
-        print("       Spusťte: pip install beautifulsoup4")
-        return
-
     # Krok 1: Zkusit se připojit a získat data
     cards_data = extract_anki_data_connect(args.deck_name)
 
@@ -502,6 +1077,9 @@ def main():
             ocr_lang=args.ocr_lang,
             force_ocr=args.force_ocr,
             image_quality=(args.image_quality if args.image_quality > 0 else None),
+            jpeg_progressive=args.progressive,
+            jpeg_subsampling=args.subsampling,
+            ocr_jobs=args.ocr_jobs,
         )
     elif cards_data is None:
          print("INFO: Generování PDF přeskočeno kvůli chybám při komunikaci s AnkiConnect.")